@@ -1,47 +1,110 @@
-import pandas as pd
+import functools
 import psycopg2
 import sys
-
-# Connessione al database Postgres
-conn = psycopg2.connect(host='localhost', database='screeningbot', user='postgres', password='dev_password')
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from psycopg2 import sql
+from psycopg2.pool import ThreadedConnectionPool
+
+# Parametri di connessione al database Postgres
+DATABASE_CONFIG = dict(host='localhost', database='screeningbot', user='postgres', password='dev_password')
+
+# Numero di tabelle elaborate in parallelo
+MAX_WORKERS = 8
+
+# Pool di connessioni al database Postgres: una per ogni thread piu' quella principale
+pool = ThreadedConnectionPool(4, 16, **DATABASE_CONFIG)
+
+# Fornisce una connessione del pool: commit se il blocco termina correttamente, rollback in caso di errore
+@contextmanager
+def get_conn():
+    conn = pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+# Ripete la funzione in caso di errori di connessione, attendendo sempre di piu' tra un tentativo e l'altro
+def retry(tries=3, backoff=2):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            delay = 1
+            for attempt in range(tries):
+                try:
+                    return func(*args, **kwargs)
+                except psycopg2.OperationalError:
+                    if attempt == tries - 1:
+                        raise
+                    time.sleep(delay)
+                    delay *= backoff
+        return wrapper
+    return decorator
+
+@retry(tries=3, backoff=2)
+def process_table(table_name, n_days):
+    crypto = table_name.replace('historical_data_', '')
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SET LOCAL synchronous_commit = off")
+
+        # Calcolo e inserimento delle performance direttamente su Postgres:
+        # la performance cumulativa di ogni giorno e' la somma delle performance
+        # dal giorno piu' vecchio degli ultimi n_days fino al giorno stesso.
+        # I giorni con prezzo di apertura pari a zero vengono scartati lato server
+        cur.execute(sql.SQL("""
+            INSERT INTO {dest} (date, performance, cumulative_performance)
+            SELECT timestamp_open::date,
+                   (close_price - open_price) / open_price * 100,
+                   SUM((close_price - open_price) / open_price * 100)
+                       OVER (ORDER BY timestamp_open DESC ROWS BETWEEN CURRENT ROW AND UNBOUNDED FOLLOWING)
+            FROM (SELECT timestamp_open, close_price, open_price FROM {source} ORDER BY timestamp_open DESC LIMIT %s) s
+            WHERE open_price <> 0
+            ON CONFLICT (date) DO UPDATE SET
+                performance = EXCLUDED.performance,
+                cumulative_performance = EXCLUDED.cumulative_performance
+        """).format(dest=sql.Identifier(f'cumulative_performance_{crypto}'), source=sql.Identifier(table_name)), (n_days,))
 
 def calculate_cumulative_performance(n_days):
-    cur = conn.cursor()
-    cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'")
-    tables = cur.fetchall()
+    # Creazione in un solo round-trip delle tabelle nel database per salvare i risultati,
+    # confermata prima di avviare i thread che le popolano
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public' AND table_name LIKE 'historical\\_data\\_%'")
+        tables = [table[0] for table in cur.fetchall()]
+
+        ddls = [sql.SQL("""
+                CREATE TABLE IF NOT EXISTS {} (
+                    date DATE PRIMARY KEY,
+                    performance NUMERIC(10, 4) NOT NULL,
+                    cumulative_performance NUMERIC(10, 4) NOT NULL
+                )
+            """).format(sql.Identifier('cumulative_performance_' + table.replace('historical_data_', ''))) for table in tables]
+        if ddls:
+            cur.execute(sql.SQL(";").join(ddls))
 
     total_tables = len(tables)
     count = 0
+    lock = threading.Lock()
 
-    for table in tables:
-        crypto = table[0].replace('historical_data_', '')
-        cur.execute(f"SELECT timestamp_open, close_price, open_price FROM {table[0]} ORDER BY timestamp_open DESC LIMIT {n_days}")
-        data = cur.fetchall()
-        df = pd.DataFrame(data, columns=['timestamp', 'close_price', 'open_price'])
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        df['performance'] = (df['close_price'] - df['open_price']) / df['open_price'] * 100
-        df['cumulative_performance'] = df['performance'][::-1].cumsum()[::-1]
-        df.set_index('timestamp', inplace=True)
-        df.dropna(inplace=True)
-
-        # Creazione della tabella nel database per salvare i risultati
-        cur.execute(f"""
-            CREATE TABLE IF NOT EXISTS cumulative_performance_{crypto} (
-                date DATE PRIMARY KEY,
-                performance NUMERIC(10, 4) NOT NULL,
-                cumulative_performance NUMERIC(10, 4) NOT NULL
-            )
-        """)
-        conn.commit()
-
-        # Inserimento dei dati nella tabella
-        for index, row in df.iterrows():
-            cur.execute(f"INSERT INTO cumulative_performance_{crypto} (date, performance, cumulative_performance) VALUES ('{index.strftime('%Y-%m-%d')}', {row['performance']}, {row['cumulative_performance']})")
-            conn.commit()
+    def worker(table_name):
+        nonlocal count
+        process_table(table_name, n_days)
+        with lock:
+            count += 1
+            progress = count / float(total_tables)
+            update_progress_bar(progress)
 
-        count += 1
-        progress = count / float(total_tables)
-        update_progress_bar(progress)
+    # Ogni tabella e' indipendente: le elaborazioni vengono eseguite in parallelo
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        list(executor.map(worker, tables))
 
     print("\nCalcolo delle performance cumulative completato.")
 
@@ -59,26 +122,23 @@ def get_user_input():
 
 # Funzione per aggiornare la barra di avanzamento
 def update_progress_bar(progress, bar_length=50):
-    sys.stdout.write('\rProgresso: ')
-    bar = '['
-    for i in range(bar_length):
-        if i < int(progress * bar_length):
-            bar += '*'
-        else:
-            bar += ' '
-    bar += ']'
-    sys.stdout.write(bar + ' ' + str(int(progress * 100.0)) + '%')
+    filled = int(progress * bar_length)
+    bar = '[' + '*' * filled + ' ' * (bar_length - filled) + ']'
+    sys.stdout.write(f'\rProgresso: {bar} {int(progress * 100.0)}%')
     sys.stdout.flush()
 
 def delete_cumulative_performance_tables():
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT table_name FROM information_schema.tables WHERE table_schema = 'public' AND table_name LIKE 'cumulative_performance%'")
-    tables = cur.fetchall()
-
-    for table in tables:
-        cur.execute(f"DROP TABLE IF EXISTS {table[0]}")
-        conn.commit()
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            DO $$
+            DECLARE r record;
+            BEGIN
+                FOR r IN SELECT tablename FROM pg_tables WHERE schemaname = 'public' AND tablename LIKE 'cumulative\\_performance%' LOOP
+                    EXECUTE 'DROP TABLE IF EXISTS public.' || quote_ident(r.tablename);
+                END LOOP;
+            END $$;
+        """)
 
     print("Tabelle cumulative_performance eliminate.")
 
@@ -88,5 +148,5 @@ delete_cumulative_performance_tables()
 n_days = get_user_input()
 calculate_cumulative_performance(n_days)
 
-# Chiusura della connessione al database Postgres
-conn.close()
+# Chiusura delle connessioni al database Postgres
+pool.closeall()
@@ -4,10 +4,14 @@ import psycopg2
 conn = psycopg2.connect(host='localhost', database='screeningbot', user='postgres', password='dev_password')
 
 cur = conn.cursor()
-cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public' AND table_type = 'BASE TABLE';")
-tables = cur.fetchall()
-
-for table in tables:
-    cur.execute(f"DROP TABLE IF EXISTS {table[0]} CASCADE;")
+cur.execute("""
+    DO $$
+    DECLARE r record;
+    BEGIN
+        FOR r IN SELECT tablename FROM pg_tables WHERE schemaname = 'public' LOOP
+            EXECUTE 'DROP TABLE IF EXISTS public.' || quote_ident(r.tablename) || ' CASCADE';
+        END LOOP;
+    END $$;
+""")
 
 conn.commit()
\ No newline at end of file